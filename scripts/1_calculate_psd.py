@@ -14,12 +14,18 @@ from config import (
     FMAX_PSD,
     FMIN_PSD,
     PSD_METHOD,
+    SAVE_FEATURE_PYRAMID,
     SUBJECT_DIR,
     T_MAX,
     T_MIN,
     get_base_results_dir,
     get_psd_data_dir,
 )
+from feature_pyramid import (
+    build_feature_pyramid,
+    get_epoch_psd_path,
+    get_feature_pyramid_path,
+)
 
 
 def load_preprocess_and_get_all_epoch_psds(
@@ -83,6 +89,7 @@ def process_subjects_and_save_psd(
     conditions: List[str],
     base_output_dir: str,
     subject_dir: List[str],
+    save_feature_pyramid: bool = False,
 ) -> None:
     """Processes subjects, calculates epoch-level PSD,
         and saves data for DR/Plotting in the format (N_epochs, N_features).
@@ -93,6 +100,8 @@ def process_subjects_and_save_psd(
         base_output_dir (str): Base directory for saving results.
         subject_dir (List[str]): List of directory name(s) for a subject(s) (e.g., "sub-01").
         If [""] - processing all subjects.
+        save_feature_pyramid (bool, optional): Also save band-, ROI- and
+        channel-averaged feature levels. Defaults to False.
     """
 
     psd_output_dir = get_psd_data_dir(base_output_dir)
@@ -194,11 +203,22 @@ def process_subjects_and_save_psd(
             "conditions": conditions,
         }
 
-        save_path = os.path.join(
-            psd_output_dir, f"{current_subject_id}_epoch_psd_data.npz"
-        )
+        save_path = get_epoch_psd_path(psd_output_dir, current_subject_id)
         np.savez_compressed(save_path, **psd_data_to_save)
 
+        pyramid_path = get_feature_pyramid_path(psd_output_dir, current_subject_id)
+        if save_feature_pyramid:
+            pyramid = build_feature_pyramid(final_psd_data_epoch, freqs, info.ch_names)
+            np.savez_compressed(pyramid_path, **pyramid)
+            print(
+                f"  ✅ Feature pyramid stored in {pyramid_path}. "
+                f"Band level shape: {pyramid['bands'].shape}"
+            )
+        elif os.path.exists(pyramid_path):
+            # A pyramid left from a previous run no longer matches the epoch PSD data
+            os.remove(pyramid_path)
+            print(f"  🗑️ Outdated feature pyramid removed: {pyramid_path}")
+
         processed_count += 1
         print(
             f"  ✅ The epoch PSD data is stored in {save_path}. Data shape for DR: {data_for_dr.shape}"
@@ -224,9 +244,19 @@ if __name__ == "__main__":
         default=get_base_results_dir(),
         help="Base directory for saving results. (default: PSD_ANALYSIS_RESULTS in the project directory)",
     )
+    parser.add_argument(
+        "--feature_pyramid",
+        action=argparse.BooleanOptionalAction,
+        default=SAVE_FEATURE_PYRAMID,
+        help="Also save band-, ROI- and channel-averaged feature levels. (default: SAVE_FEATURE_PYRAMID from config.py)",
+    )
 
     args = parser.parse_args()
 
     process_subjects_and_save_psd(
-        args.data_root, CONDITIONS, args.base_output_dir, SUBJECT_DIR
+        args.data_root,
+        CONDITIONS,
+        args.base_output_dir,
+        SUBJECT_DIR,
+        args.feature_pyramid,
     )
@@ -16,6 +16,7 @@ from config import (
     get_psd_data_dir,
     get_psd_plots_dir,
 )
+from feature_pyramid import load_feature_level
 
 
 def plot_psd_graphs(
@@ -133,12 +134,25 @@ def load_and_plot_subjects(base_input_dir: str) -> None:
             conditions = data["conditions"].tolist()
 
             # Load epoch-level data
-            epoch_psds = data["epoch_psds"]  # (N_epochs, N_channels, N_freqs)
             labels = data["labels"]
             run_labels = data["run_labels"]
 
             # Preliminary averaging: across channels for all epochs (aggregation step)
-            avg_psds_per_epoch = epoch_psds.mean(axis=1)  # (N_epochs, N_freqs)
+            # Reuse the precomputed level of the feature pyramid when available
+            avg_psds_per_epoch: np.ndarray | None
+            try:
+                avg_psds_per_epoch = load_feature_level(
+                    data_input_dir, subject_id, "channel_avg"
+                )  # (N_epochs, N_freqs)
+            except FileNotFoundError:
+                avg_psds_per_epoch = None
+            except ValueError as e:
+                print(f"  ⚠️ {e} Using the epoch PSD data.")
+                avg_psds_per_epoch = None
+
+            if avg_psds_per_epoch is None:
+                epoch_psds = data["epoch_psds"]  # (N_epochs, N_channels, N_freqs)
+                avg_psds_per_epoch = epoch_psds.mean(axis=1)  # (N_epochs, N_freqs)
 
             # Create "long" DataFrame for easy grouping
             n_epochs, n_freqs = avg_psds_per_epoch.shape
@@ -1,13 +1,20 @@
 import argparse
 import glob
+import multiprocessing
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import plotly.express as px
 from config import (
     CONDITIONS,
+    DR_FEATURE_LEVEL,
     DR_FREQ_BAND,
+    DR_N_JOBS,
+    DR_THREAD_BUDGET,
     FREQ_BANDS,
     PCA_N_COMPONENTS,
     UMAP_N_COMPONENTS,
@@ -16,148 +23,390 @@ from config import (
     get_dr_plots_dir,
     get_psd_data_dir,
 )
+from feature_pyramid import load_feature_level
 from sklearn.decomposition import PCA
 from umap import UMAP
 
+# (subject_id, status, message, elapsed seconds); status: "done", "skipped", "error"
+SubjectResult = Tuple[str, str, str, float]
 
-def analyze_and_plot_dr_interactive(
-    base_input_dir: str, umap_n_comp: int, umap_n_neigh: int
-) -> None:
-    """Loads data, applies UMAP and PCA, generates an interactive 3D plot,
-    and saves the HTML file to the DR_PLOTS folder.
+# Thread pools used by UMAP (numba), scikit-learn (OpenMP) and numpy (BLAS)
+THREAD_ENV_VARS = [
+    "NUMBA_NUM_THREADS",
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+]
 
-    Args:
-        base_input_dir (str): Base directory containing the PSD_DATA folder.
-        umap_n_comp (int): Intermediate dimensionality for UMAP.
-        umap_n_neigh (int): Number of neighbors for UMAP.
-    """
 
-    data_input_dir = get_psd_data_dir(base_input_dir)
-    plot_output_dir = get_dr_plots_dir(base_input_dir)
-    os.makedirs(plot_output_dir, exist_ok=True)
+def split_thread_budget(
+    n_jobs: int, thread_budget: Optional[int] = None
+) -> Tuple[int, int]:
+    """Splits the numba/OpenMP/BLAS thread budget across worker processes.
+    The number of jobs is capped at the budget, so that every worker gets
+    at least one thread without exceeding it.
 
-    npz_files = glob.glob(os.path.join(data_input_dir, "*_epoch_psd_data.npz"))
+    Args:
+        n_jobs (int): Requested number of worker processes.
+        thread_budget (Optional[int], optional): Total number of threads for all
+            workers. Defaults to None (number of CPUs).
 
-    if not npz_files:
+    Returns:
+        Tuple[int, int]: number of worker processes and number of threads
+            for a single worker.
+    """
+    if thread_budget is None:
+        thread_budget = os.cpu_count() or 1
+    thread_budget = max(1, thread_budget)
+
+    if n_jobs > thread_budget:
         print(
-            f"❌ No *_epoch_psd_data.npz files found in '{data_input_dir}'. Please run 1_calculate_psd.py first."
+            f"⚠️ {n_jobs} jobs exceed the budget of {thread_budget} thread(s). "
+            f"Using {thread_budget} job(s)."
         )
-        return
-
-    for file_path in sorted(npz_files):
-        file_name = os.path.basename(file_path)
-        subject_id = file_name.replace("_epoch_psd_data.npz", "")
+        n_jobs = thread_budget
 
-        print(f"\n===== DR ANALYSIS FOR SUBJECT: {subject_id} =====")
+    return n_jobs, thread_budget // n_jobs
 
-        try:
-            data = np.load(file_path, allow_pickle=True)
-            X = data["data_for_dr"]
-            labels = data["labels"]
-            run_labels = data["run_labels"]
-            freqs = data["freqs"]
 
-            # Filter data by conditions from config
-            mask = np.isin(labels, CONDITIONS)
-            X_filtered = X[mask]
-            labels_filtered = labels[mask]
-            run_labels_filtered = run_labels[mask]
+def set_worker_thread_limits(n_threads: int) -> Dict[str, Optional[str]]:
+    """Sets thread limits in the environment inherited by spawned workers.
+    The variables are read when numba/BLAS are imported, so the workers must be
+    started with the "spawn" method after this call.
 
-            if DR_FREQ_BAND != "ALL":
-                f_min, f_max = FREQ_BANDS[DR_FREQ_BAND]
+    Args:
+        n_threads (int): Number of threads for a single worker.
 
-                freq_indices = np.where((freqs >= f_min) & (freqs <= f_max))[0]
+    Returns:
+        Dict[str, Optional[str]]: Previous values of the variables.
+    """
+    previous = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    return previous
 
-                if freq_indices.size == 0:
-                    print(
-                        f"⚠️ There are no frequencies in the selected range '{DR_FREQ_BAND}' ({f_min}-{f_max} Hz). Skip."
-                    )
-                    continue
 
-                n_freqs_all = len(freqs)
-                # n_channels * n_freqs_all = X_filtered.shape[1]
-                n_channels = X_filtered.shape[1] // n_freqs_all
+def restore_thread_limits(previous: Dict[str, Optional[str]]) -> None:
+    """
 
-                # (N_epochs, N_channels, N_freqs)
-                X_reshaped = X_filtered.reshape(
-                    X_filtered.shape[0], n_channels, n_freqs_all
-                )
+    Args:
+        previous (Dict[str, Optional[str]]): Values to restore.
+    """
+    for var, value in previous.items():
+        if value is None:
+            os.environ.pop(var, None)
+        else:
+            os.environ[var] = value
+
+
+def process_subject_dr(
+    file_path: str,
+    data_input_dir: str,
+    plot_output_dir: str,
+    umap_n_comp: int,
+    umap_n_neigh: int,
+) -> SubjectResult:
+    """Applies UMAP and PCA to the PSD data of a single subject,
+    generates an interactive 3D plot and saves it to the DR_PLOTS folder.
 
-                X_band_selected = X_reshaped[:, :, freq_indices]
-                X_filtered = X_band_selected.reshape(X_band_selected.shape[0], -1)
+    Args:
+        file_path (str): Path to the epoch PSD file of the subject.
+        data_input_dir (str): Folder with PSD data (.npz).
+        plot_output_dir (str): Directory where the plot will be saved.
+        umap_n_comp (int): Intermediate dimensionality for UMAP.
+        umap_n_neigh (int): Number of neighbors for UMAP.
 
-                print(
-                    f"✅ Data filtered by range: {DR_FREQ_BAND} ({f_min}-{f_max} Hz). New shape: {X_filtered.shape[1]}"
-                )
+    Returns:
+        SubjectResult: subject ID, status, path to the plot or the reason
+            for skipping/error, and elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    file_name = os.path.basename(file_path)
+    subject_id = file_name.replace("_epoch_psd_data.npz", "")
 
-            if X_filtered.shape[0] < 2 * umap_n_neigh:
-                print("⚠️ Not enough epochs for UMAP. Skipping.")
-                continue
+    print(f"\n===== DR ANALYSIS FOR SUBJECT: {subject_id} =====")
 
-            print(f"Step 1/3: UMAP (N={umap_n_neigh}, D={umap_n_comp})")
+    try:
+        data = np.load(file_path, allow_pickle=True)
+        labels = data["labels"]
+        run_labels = data["run_labels"]
+        freqs = data["freqs"]
 
-            reducer = UMAP(
-                n_neighbors=umap_n_neigh,
-                n_components=umap_n_comp,
-                metric="euclidean",
-                random_state=42,
-                verbose=False,
+        if DR_FEATURE_LEVEL == "full":
+            X = data["data_for_dr"]
+        elif DR_FEATURE_LEVEL == "bands" and DR_FREQ_BAND != "ALL":
+            # (N_epochs, N_channels, N_bands) -> power of the selected band
+            band_power, band_names = load_feature_level(
+                data_input_dir, subject_id, "bands", return_names=True
+            )
+            if DR_FREQ_BAND not in band_names:
+                message = f"There is no band '{DR_FREQ_BAND}' in the feature pyramid."
+                print(f"⚠️ {message} Skip.")
+                return subject_id, "skipped", message, time.perf_counter() - start
+
+            X = band_power[:, :, band_names.index(DR_FREQ_BAND)]
+            print(f"✅ Feature level: bands ({DR_FREQ_BAND}). Shape: {X.shape}")
+        else:
+            X = load_feature_level(
+                data_input_dir, subject_id, DR_FEATURE_LEVEL, flatten=True
             )
-            X_umap = reducer.fit_transform(X_filtered)
+            print(f"✅ Feature level: {DR_FEATURE_LEVEL}. Shape: {X.shape}")
 
-            # Use PCA_N_COMPONENTS from config.py
-            print(f"Step 2/3: PCA (D={PCA_N_COMPONENTS})")
-            pca = PCA(n_components=PCA_N_COMPONENTS)
-            X_pca_3d = pca.fit_transform(X_umap)
+        # Filter data by conditions from config
+        mask = np.isin(labels, CONDITIONS)
+        X_filtered = X[mask]
+        labels_filtered = labels[mask]
+        run_labels_filtered = run_labels[mask]
 
-            # Prepare data for Plotly
-            df = pd.DataFrame(X_pca_3d, columns=["PC 1", "PC 2", "PC 3"])
-            df["Condition"] = labels_filtered
-            df["Run"] = run_labels_filtered
+        # The band of the "bands" level is selected on loading
+        if DR_FREQ_BAND != "ALL" and DR_FEATURE_LEVEL != "bands":
+            f_min, f_max = FREQ_BANDS[DR_FREQ_BAND]
 
-            # Create a combined label for coloring
-            df["Condition_Run"] = (
-                df["Condition"].astype(str) + "_" + df["Run"].astype(str)
-            )
+            freq_indices = np.where((freqs >= f_min) & (freqs <= f_max))[0]
 
-            # 3. Interactive 3D visualization with Plotly
-            print("Step 3/3: Interactive Plotly visualization...")
+            if freq_indices.size == 0:
+                message = f"There are no frequencies in the selected range '{DR_FREQ_BAND}' ({f_min}-{f_max} Hz)."
+                print(f"⚠️ {message} Skip.")
+                return subject_id, "skipped", message, time.perf_counter() - start
 
-            plot_title = (
-                f"[{subject_id}] PSD DR: UMAP -> PCA (Band: {DR_FREQ_BAND})<br>"
-                f"UMAP:<br>"
-                f"Number of neighbors = {UMAP_N_NEIGHBORS}<br>"
-                f"Number of components = {UMAP_N_COMPONENTS}"
-            )
+            n_freqs_all = len(freqs)
+            # n_channels * n_freqs_all = X_filtered.shape[1]
+            # (ROIs for the "roi" level, 1 for the "channel_avg" level)
+            n_channels = X_filtered.shape[1] // n_freqs_all
 
-            fig = px.scatter_3d(
-                df,
-                x="PC 1",
-                y="PC 2",
-                z="PC 3",
-                color="Condition",
-                symbol="Condition_Run",
-                hover_data=["Condition", "Run"],
-                title=plot_title,
-                opacity=0.7,
-                height=700,
+            # (N_epochs, N_channels, N_freqs)
+            X_reshaped = X_filtered.reshape(
+                X_filtered.shape[0], n_channels, n_freqs_all
             )
 
-            fig.update_traces(marker=dict(size=4))
+            X_band_selected = X_reshaped[:, :, freq_indices]
+            X_filtered = X_band_selected.reshape(X_band_selected.shape[0], -1)
 
-            # Save the plot to an interactive HTML file in DR_PLOTS
-            save_path = os.path.join(
-                plot_output_dir, f"{subject_id}_dr_umap_pca_3d_interactive.html"
+            print(
+                f"✅ Data filtered by range: {DR_FREQ_BAND} ({f_min}-{f_max} Hz). New shape: {X_filtered.shape[1]}"
             )
-            fig.write_html(save_path)
 
-            print(f"✅ Interactive 3D plot saved to {save_path}")
+        if X_filtered.shape[0] < 2 * umap_n_neigh:
+            message = "Not enough epochs for UMAP."
+            print(f"⚠️ {message} Skipping.")
+            return subject_id, "skipped", message, time.perf_counter() - start
+
+        print(f"Step 1/3: UMAP (N={umap_n_neigh}, D={umap_n_comp})")
+
+        reducer = UMAP(
+            n_neighbors=umap_n_neigh,
+            n_components=umap_n_comp,
+            metric="euclidean",
+            random_state=42,
+            verbose=False,
+        )
+        X_umap = reducer.fit_transform(X_filtered)
+
+        # Use PCA_N_COMPONENTS from config.py
+        print(f"Step 2/3: PCA (D={PCA_N_COMPONENTS})")
+        pca = PCA(n_components=PCA_N_COMPONENTS)
+        X_pca_3d = pca.fit_transform(X_umap)
+
+        # Prepare data for Plotly
+        df = pd.DataFrame(X_pca_3d, columns=["PC 1", "PC 2", "PC 3"])
+        df["Condition"] = labels_filtered
+        df["Run"] = run_labels_filtered
+
+        # Create a combined label for coloring
+        df["Condition_Run"] = df["Condition"].astype(str) + "_" + df["Run"].astype(str)
+
+        # 3. Interactive 3D visualization with Plotly
+        print("Step 3/3: Interactive Plotly visualization...")
+
+        plot_title = (
+            f"[{subject_id}] PSD DR: UMAP -> PCA "
+            f"(Band: {DR_FREQ_BAND}, Level: {DR_FEATURE_LEVEL})<br>"
+            f"UMAP:<br>"
+            f"Number of neighbors = {UMAP_N_NEIGHBORS}<br>"
+            f"Number of components = {UMAP_N_COMPONENTS}"
+        )
+
+        fig = px.scatter_3d(
+            df,
+            x="PC 1",
+            y="PC 2",
+            z="PC 3",
+            color="Condition",
+            symbol="Condition_Run",
+            hover_data=["Condition", "Run"],
+            title=plot_title,
+            opacity=0.7,
+            height=700,
+        )
+
+        fig.update_traces(marker=dict(size=4))
+
+        # Save the plot to an interactive HTML file in DR_PLOTS
+        save_path = os.path.join(
+            plot_output_dir, f"{subject_id}_dr_umap_pca_3d_interactive.html"
+        )
+        fig.write_html(save_path)
+
+        print(f"✅ Interactive 3D plot saved to {save_path}")
+        return subject_id, "done", save_path, time.perf_counter() - start
+
+    except Exception as e:
+        print(f"❌ Error during DR or plotting for {subject_id}: {e}")
+        return subject_id, "error", str(e), time.perf_counter() - start
+
 
-        except Exception as e:
-            print(f"❌ Error during DR or plotting for {subject_id}: {e}")
-            continue
+def save_scaling_report(
+    plot_output_dir: str,
+    n_jobs: int,
+    threads_per_job: int,
+    umap_n_comp: int,
+    umap_n_neigh: int,
+    n_subjects: int,
+    results: List[SubjectResult],
+    wall_time: float,
+) -> None:
+    """Appends the throughput of the run to dr_scaling_report.csv
+    and prints subjects/hour for every number of jobs measured so far.
+    Only runs with the same DR parameters and subjects are compared.
+
+    Args:
+        plot_output_dir (str): Directory where the report will be saved.
+        n_jobs (int): Number of worker processes.
+        threads_per_job (int): Number of threads for a single worker.
+        umap_n_comp (int): Intermediate dimensionality for UMAP.
+        umap_n_neigh (int): Number of neighbors for UMAP.
+        n_subjects (int): Number of subjects submitted in the run.
+        results (List[SubjectResult]): Per-subject results of the run.
+        wall_time (float): Total time of the run in seconds.
+    """
+    n_done = sum(1 for _, status, _, _ in results if status == "done")
+    report_path = os.path.join(plot_output_dir, "dr_scaling_report.csv")
+    run_params = {
+        "Feature_Level": DR_FEATURE_LEVEL,
+        "Freq_Band": DR_FREQ_BAND,
+        "UMAP_Dim": umap_n_comp,
+        "UMAP_Neighbors": umap_n_neigh,
+        "Subjects_Total": n_subjects,
+    }
+
+    run_df = pd.DataFrame(
+        {
+            **{column: [value] for column, value in run_params.items()},
+            "Jobs": [n_jobs],
+            "Threads_Per_Job": [threads_per_job],
+            "Threads_Total": [n_jobs * threads_per_job],
+            "Subjects": [n_done],
+            "Wall_Time_s": [wall_time],
+            "Subjects_Per_Hour": [n_done * 3600 / wall_time if wall_time > 0 else 0.0],
+        }
+    )
+
+    # Rewrite the whole file so that older reports with fewer columns stay readable
+    if os.path.exists(report_path):
+        run_df = pd.concat([pd.read_csv(report_path), run_df], ignore_index=True)
+    run_df.to_csv(report_path, index=False)
+
+    # Rows without the run parameters (NaN keys) are left out of the summary
+    summary = (
+        run_df.groupby([*run_params, "Jobs", "Threads_Per_Job", "Threads_Total"])[
+            "Subjects_Per_Hour"
+        ]
+        .agg(["mean", "count"])
+        .rename(columns={"mean": "Subjects_Per_Hour", "count": "Runs"})
+    )
+
+    print(f"\n📊 Scaling report (all runs in {report_path}):")
+    print(summary.to_string(float_format="{:.1f}".format))
+
+
+def analyze_and_plot_dr_interactive(
+    base_input_dir: str,
+    umap_n_comp: int,
+    umap_n_neigh: int,
+    n_jobs: int = 1,
+    thread_budget: Optional[int] = None,
+) -> None:
+    """Loads data, applies UMAP and PCA, generates an interactive 3D plot,
+    and saves the HTML file to the DR_PLOTS folder.
+
+    Args:
+        base_input_dir (str): Base directory containing the PSD_DATA folder.
+        umap_n_comp (int): Intermediate dimensionality for UMAP.
+        umap_n_neigh (int): Number of neighbors for UMAP.
+        n_jobs (int, optional): Number of subjects processed concurrently.
+            Defaults to 1.
+        thread_budget (Optional[int], optional): Total number of numba/OpenMP/BLAS
+            threads split across workers. Defaults to None (number of CPUs).
+    """
+
+    data_input_dir = get_psd_data_dir(base_input_dir)
+    plot_output_dir = get_dr_plots_dir(base_input_dir)
+    os.makedirs(plot_output_dir, exist_ok=True)
+
+    npz_files = glob.glob(os.path.join(data_input_dir, "*_epoch_psd_data.npz"))
+
+    if not npz_files:
+        print(
+            f"❌ No *_epoch_psd_data.npz files found in '{data_input_dir}'. Please run 1_calculate_psd.py first."
+        )
+        return
+
+    n_jobs, threads_per_job = split_thread_budget(
+        max(1, min(n_jobs, len(npz_files))), thread_budget
+    )
+    task_args = [
+        (file_path, data_input_dir, plot_output_dir, umap_n_comp, umap_n_neigh)
+        for file_path in sorted(npz_files)
+    ]
+
+    results: List[SubjectResult] = []
+    start = time.perf_counter()
+
+    print(f"⚙️ Running {n_jobs} job(s) with {threads_per_job} thread(s) each.")
+
+    # Workers are spawned (not forked) so that they import numba/BLAS
+    # with the thread limits set in the environment. A single job also runs
+    # in a worker: numba/BLAS in this process already use all CPUs.
+    previous_limits = set_worker_thread_limits(threads_per_job)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {
+                executor.submit(process_subject_dr, *args): args[0]
+                for args in task_args
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # Worker crashed outside of the per-subject error handling
+                    subject_id = os.path.basename(futures[future]).replace(
+                        "_epoch_psd_data.npz", ""
+                    )
+                    results.append((subject_id, "error", str(e), 0.0))
+    finally:
+        restore_thread_limits(previous_limits)
+
+    wall_time = time.perf_counter() - start
 
     print("\n==========================================")
+    for subject_id, status, message, elapsed in sorted(results):
+        icon = {"done": "✅", "skipped": "⚠️", "error": "❌"}[status]
+        print(f"{icon} {subject_id}: {status} ({elapsed:.1f} s) {message}")
+
+    save_scaling_report(
+        plot_output_dir,
+        n_jobs,
+        threads_per_job,
+        umap_n_comp,
+        umap_n_neigh,
+        len(task_args),
+        results,
+        wall_time,
+    )
+
     print("Interactive dimensionality analysis complete.")
 
 
@@ -184,8 +433,25 @@ if __name__ == "__main__":
         help="Number of neighbors for UMAP (default: 20).",
     )
 
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=DR_N_JOBS,
+        help=f"Number of subjects processed concurrently (default: {DR_N_JOBS}).",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=DR_THREAD_BUDGET,
+        help="Total number of numba/OpenMP/BLAS threads split across jobs (default: number of CPUs).",
+    )
+
     args = parser.parse_args()
 
     analyze_and_plot_dr_interactive(
-        args.base_input_dir, args.umap_dim, args.umap_neighbors
+        args.base_input_dir,
+        args.umap_dim,
+        args.umap_neighbors,
+        args.jobs,
+        args.threads,
     )
@@ -92,15 +92,27 @@ PSD_METHOD = "multitaper"
 FMIN_PSD = 3
 FMAX_PSD = 35
 
+# FEATURE PYRAMID
+
+SAVE_FEATURE_PYRAMID = False  # Save reduced feature levels next to the PSD data
+ROI_CHANNELS = {  # Channels missing from the recording are ignored
+    "FRONTAL": ["Fp1", "Fp2", "F7", "F3", "Fz", "F4", "F8"],
+    "CENTRAL": ["FC3", "FCz", "FC4", "C3", "Cz", "C4"],
+    "TEMPORAL": ["T7", "T8", "TP7", "TP8"],
+    "PARIETAL": ["CP3", "CPz", "CP4", "P3", "Pz", "P4"],
+    "OCCIPITAL": ["O1", "Oz", "O2"],
+}
+
 # UMAP PARAMETERS
 
-FREQ_BANDS = {
+FREQ_BANDS = {  # Also used by the feature pyramid ("bands" level)
     "ALL": (3, 35),
     "THETA": (4, 7),
     "ALPHA": (9, 13),
     "BETA": (14, 35),
 }
 DR_FREQ_BAND = "ALL"  # "ALL", "THETA", "ALPHA", "BETA"
+DR_FEATURE_LEVEL = "full"  # "full", "bands", "roi", "channel_avg"
 
 UMAP_N_COMPONENTS = 100
 UMAP_N_NEIGHBORS = 20
@@ -108,6 +120,10 @@ UMAP_N_NEIGHBORS = 20
 # PCA PARAMETERS
 PCA_N_COMPONENTS = 3
 
+# PARALLEL DR
+DR_N_JOBS = 1  # Number of subjects processed concurrently
+DR_THREAD_BUDGET = None  # Total numba/OpenMP/BLAS threads, None - number of CPUs
+
 # PLOTS COLORS
 colors_runs = {
     cond: c for cond, c in zip(CONDITIONS, ["#6A5ACD", "#3CB371", "#FF8C00"])
@@ -0,0 +1,310 @@
+import os
+from typing import Any, Dict, List, Literal, Tuple, overload
+
+import numpy as np
+from config import FREQ_BANDS, ROI_CHANNELS
+
+PYRAMID_LEVELS = ["full", "bands", "roi", "channel_avg"]
+
+# Keys with the names of the second axis of each level
+LEVEL_NAMES_KEYS = {
+    "full": "channels",
+    "bands": "band_names",
+    "roi": "roi_names",
+    "channel_avg": None,
+}
+
+
+def get_epoch_psd_path(psd_data_dir: str, subject_id: str) -> str:
+    """
+
+    Args:
+        psd_data_dir (str): Folder with PSD data (.npz).
+        subject_id (str): The ID of the subject (e.g., "sub-01").
+
+    Returns:
+        str: path to the full-resolution epoch PSD file of the subject.
+    """
+    return os.path.join(psd_data_dir, f"{subject_id}_epoch_psd_data.npz")
+
+
+def get_feature_pyramid_path(psd_data_dir: str, subject_id: str) -> str:
+    """
+
+    Args:
+        psd_data_dir (str): Folder with PSD data (.npz).
+        subject_id (str): The ID of the subject (e.g., "sub-01").
+
+    Returns:
+        str: path to the feature pyramid file of the subject.
+    """
+    return os.path.join(psd_data_dir, f"{subject_id}_feature_pyramid.npz")
+
+
+def compute_band_power(
+    epoch_psds: np.ndarray, freqs: np.ndarray, freq_bands: Dict[str, Tuple[int, int]]
+) -> Tuple[np.ndarray, List[str]]:
+    """Integrates PSD over each frequency band for every channel.
+
+    Args:
+        epoch_psds (np.ndarray): PSD of shape (N_epochs, N_channels, N_freqs).
+        freqs (np.ndarray): The array of frequency values.
+        freq_bands (Dict[str, Tuple[int, int]]): Band name -> (f_min, f_max) in Hz.
+
+    Returns:
+        Tuple[np.ndarray, List[str]]: A tuple containing:
+            1. band_power: np.ndarray
+                Band power of shape (N_epochs, N_channels, N_bands).
+            2. band_names: List[str]
+                Names of the bands that contain at least one frequency bin.
+    """
+    # Frequency resolution (multitaper returns a uniform grid)
+    df = float(freqs[1] - freqs[0]) if len(freqs) > 1 else 1.0
+
+    band_powers = []
+    band_names = []
+    for band_name, (f_min, f_max) in freq_bands.items():
+        freq_mask = (freqs >= f_min) & (freqs <= f_max)
+        if not freq_mask.any():
+            print(
+                f"  ⚠️ There are no frequencies in the band '{band_name}' ({f_min}-{f_max} Hz). Skip."
+            )
+            continue
+
+        band_powers.append(epoch_psds[:, :, freq_mask].sum(axis=-1) * df)
+        band_names.append(band_name)
+
+    if not band_powers:
+        return np.empty((*epoch_psds.shape[:2], 0)), band_names
+
+    return np.stack(band_powers, axis=-1), band_names
+
+
+def compute_roi_spectra(
+    epoch_psds: np.ndarray, channels: List[str], roi_channels: Dict[str, List[str]]
+) -> Tuple[np.ndarray, List[str]]:
+    """Averages PSD over the channels of each region of interest.
+
+    Args:
+        epoch_psds (np.ndarray): PSD of shape (N_epochs, N_channels, N_freqs).
+        channels (List[str]): Channel names in the order of the channel axis.
+        roi_channels (Dict[str, List[str]]): ROI name -> list of channel names.
+
+    Returns:
+        Tuple[np.ndarray, List[str]]: A tuple containing:
+            1. roi_psds: np.ndarray
+                ROI-averaged PSD of shape (N_epochs, N_rois, N_freqs).
+            2. roi_names: List[str]
+                Names of the ROIs that contain at least one recorded channel.
+    """
+    ch_index = {ch: i for i, ch in enumerate(channels)}
+
+    roi_psds = []
+    roi_names = []
+    for roi_name, roi_chs in roi_channels.items():
+        picks = [ch_index[ch] for ch in roi_chs if ch in ch_index]
+        if not picks:
+            print(f"  ⚠️ None of the channels of ROI '{roi_name}' are recorded. Skip.")
+            continue
+
+        roi_psds.append(epoch_psds[:, picks, :].mean(axis=1))
+        roi_names.append(roi_name)
+
+    if not roi_psds:
+        return np.empty((epoch_psds.shape[0], 0, epoch_psds.shape[2])), roi_names
+
+    return np.stack(roi_psds, axis=1), roi_names
+
+
+def get_band_edges(freq_bands: Dict[str, Tuple[int, int]]) -> np.ndarray:
+    """
+
+    Args:
+        freq_bands (Dict[str, Tuple[int, int]]): Band name -> (f_min, f_max) in Hz.
+
+    Returns:
+        np.ndarray: (f_min, f_max) of every configured band, shape (N_bands, 2).
+    """
+    return np.array(list(freq_bands.values()), dtype=float).reshape(-1, 2)
+
+
+def get_roi_channel_pairs(roi_channels: Dict[str, List[str]]) -> np.ndarray:
+    """
+
+    Args:
+        roi_channels (Dict[str, List[str]]): ROI name -> list of channel names.
+
+    Returns:
+        np.ndarray: (ROI name, channel name) of every configured ROI member,
+            shape (N_pairs, 2).
+    """
+    pairs = [[roi, ch] for roi, roi_chs in roi_channels.items() for ch in roi_chs]
+    return np.array(pairs, dtype=str).reshape(-1, 2)
+
+
+def build_feature_pyramid(
+    epoch_psds: np.ndarray, freqs: np.ndarray, channels: List[str]
+) -> Dict[str, Any]:
+    """Computes the reduced levels of the feature pyramid.
+    The full-resolution level is not duplicated: it is read from the epoch PSD file.
+
+    Args:
+        epoch_psds (np.ndarray): PSD of shape (N_epochs, N_channels, N_freqs).
+        freqs (np.ndarray): The array of frequency values.
+        channels (List[str]): Channel names in the order of the channel axis.
+
+    Returns:
+        Dict[str, Any]: Arrays to be saved in the feature pyramid file.
+    """
+    band_power, band_names = compute_band_power(epoch_psds, freqs, FREQ_BANDS)
+    roi_psds, roi_names = compute_roi_spectra(epoch_psds, channels, ROI_CHANNELS)
+
+    return {
+        "bands": band_power,  # (N_epochs, N_channels, N_bands)
+        "roi": roi_psds,  # (N_epochs, N_rois, N_freqs)
+        "channel_avg": epoch_psds.mean(axis=1),  # (N_epochs, N_freqs)
+        "band_names": np.array(band_names),
+        "roi_names": np.array(roi_names),
+        "freqs": freqs,
+        "channels": np.array(channels),
+        # Configuration the pyramid was built with (to detect outdated files)
+        "band_edge_names": np.array(list(FREQ_BANDS), dtype=str),
+        "band_edges": get_band_edges(FREQ_BANDS),  # (N_configured_bands, 2)
+        "roi_channels": get_roi_channel_pairs(ROI_CHANNELS),  # (N_pairs, 2)
+    }
+
+
+def pyramid_matches(pyramid: Any, epoch_data: Any) -> bool:
+    """Compares an opened feature pyramid with the epoch PSD data and the config.
+
+    Args:
+        pyramid (Any): Opened feature pyramid archive (np.load).
+        epoch_data (Any): Opened epoch PSD archive (np.load).
+
+    Returns:
+        bool: True if the pyramid matches the epochs, frequencies and channels
+            of the epoch PSD data and the current FREQ_BANDS and ROI_CHANNELS.
+    """
+    if not {"band_edge_names", "band_edges", "roi_channels"} <= set(pyramid.files):
+        return False
+
+    return bool(
+        pyramid["channel_avg"].shape[0] == len(epoch_data["labels"])
+        and np.array_equal(pyramid["freqs"], epoch_data["freqs"])
+        and list(pyramid["channels"]) == list(epoch_data["channels"])
+        and list(pyramid["band_edge_names"]) == list(FREQ_BANDS)
+        and np.array_equal(pyramid["band_edges"], get_band_edges(FREQ_BANDS))
+        and np.array_equal(pyramid["roi_channels"], get_roi_channel_pairs(ROI_CHANNELS))
+    )
+
+
+def is_feature_pyramid_current(psd_data_dir: str, subject_id: str) -> bool:
+    """Checks that the feature pyramid was built from the current epoch PSD file
+    and the current FREQ_BANDS and ROI_CHANNELS.
+
+    Args:
+        psd_data_dir (str): Folder with PSD data (.npz).
+        subject_id (str): The ID of the subject (e.g., "sub-01").
+
+    Returns:
+        bool: True if the pyramid exists and is up to date.
+    """
+    epoch_path = get_epoch_psd_path(psd_data_dir, subject_id)
+    pyramid_path = get_feature_pyramid_path(psd_data_dir, subject_id)
+    if not os.path.exists(epoch_path) or not os.path.exists(pyramid_path):
+        return False
+
+    with (
+        np.load(epoch_path, allow_pickle=True) as epoch_data,
+        np.load(pyramid_path, allow_pickle=True) as pyramid,
+    ):
+        return pyramid_matches(pyramid, epoch_data)
+
+
+@overload
+def load_feature_level(
+    psd_data_dir: str,
+    subject_id: str,
+    level: str,
+    flatten: bool = ...,
+    return_names: Literal[False] = ...,
+) -> np.ndarray: ...
+
+
+@overload
+def load_feature_level(
+    psd_data_dir: str,
+    subject_id: str,
+    level: str,
+    flatten: bool = ...,
+    *,
+    return_names: Literal[True],
+) -> Tuple[np.ndarray, List[str]]: ...
+
+
+def load_feature_level(
+    psd_data_dir: str,
+    subject_id: str,
+    level: str,
+    flatten: bool = False,
+    return_names: bool = False,
+) -> np.ndarray | Tuple[np.ndarray, List[str]]:
+    """Loads a single level of the feature pyramid of a subject.
+
+    Args:
+        psd_data_dir (str): Folder with PSD data (.npz).
+        subject_id (str): The ID of the subject (e.g., "sub-01").
+        level (str): One of "full", "bands", "roi", "channel_avg".
+            Reduced levels are checked against the epoch PSD file and the config,
+            ValueError is raised if the pyramid is outdated.
+        flatten (bool, optional): Reshape to (N_epochs, N_features) for DR.
+            Defaults to False.
+        return_names (bool, optional): Also return the names of the second axis
+            (channels, bands or ROIs; empty for "channel_avg"). Defaults to False.
+
+    Returns:
+        np.ndarray | Tuple[np.ndarray, List[str]]: The requested level, epochs
+            along the first axis, and optionally the names of the second axis.
+    """
+    if level not in PYRAMID_LEVELS:
+        raise ValueError(
+            f"Unknown feature level '{level}'. Use one of {PYRAMID_LEVELS}."
+        )
+
+    if level == "full":
+        file_path = get_epoch_psd_path(psd_data_dir, subject_id)
+        key = "epoch_psds"
+    else:
+        file_path = get_feature_pyramid_path(psd_data_dir, subject_id)
+        key = level
+
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(
+            f"{file_path} not found. Run 1_calculate_psd.py with --feature_pyramid first."
+        )
+
+    # Only the requested arrays are read from the archive
+    names_key = LEVEL_NAMES_KEYS[level]
+    with np.load(file_path, allow_pickle=True) as data:
+        if level != "full":
+            epoch_path = get_epoch_psd_path(psd_data_dir, subject_id)
+            if not os.path.exists(epoch_path):
+                raise FileNotFoundError(f"{epoch_path} not found.")
+
+            with np.load(epoch_path, allow_pickle=True) as epoch_data:
+                if not pyramid_matches(data, epoch_data):
+                    raise ValueError(
+                        f"{file_path} does not match the epoch PSD data or the "
+                        "FREQ_BANDS/ROI_CHANNELS config. "
+                        "Rerun 1_calculate_psd.py with --feature_pyramid."
+                    )
+
+        features = np.asarray(data[key])
+        names = [str(name) for name in data[names_key]] if names_key else []
+
+    if flatten:
+        features = features.reshape(features.shape[0], -1)
+
+    if return_names:
+        return features, names
+    return features